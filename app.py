@@ -1,9 +1,14 @@
 # Import necessary libraries and modules 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
-import bcrypt
-import jwt
+import hmac
+from itertools import islice
+import orjson
+import fastjsonschema
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from werkzeug.exceptions import HTTPException
 
 # Load environment variables from a .env file
 from dotenv import load_dotenv
@@ -15,6 +20,7 @@ from dotenv import load_dotenv
 from utils import utilities
 from utils.database import database
 from utils.logging import logging
+from utils.json_provider import OrjsonProvider
 from flasgger import Swagger
 
 # Load environment variables from the .env file into the app
@@ -23,16 +29,64 @@ load_dotenv()
 # Initialize the Flask application
 app = Flask(__name__)
 
+# Use orjson for request parsing and jsonify responses
+app.json = OrjsonProvider(app)
+
 # Enable Cross-Origin Resource Sharing (CORS) for the Flask app
 CORS(app)
 
 # Secret key for JWT
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 
+# Handle any unexpected error raised by an endpoint with a uniform 500 response.
+# HTTP errors (404, 405, ...) are passed through unchanged.
+@app.errorhandler(Exception)
+def handle_exception(e):
+    if isinstance(e, HTTPException):
+        return e
+    logging.error("handle_exception();Unhandled error: %s", e, exc_info=e)
+    return jsonify({"message": "Internal server error"}), 500
+
 # Initialize Swagger
 # /apidocs
 swagger = Swagger(app)
 
+# Number of documents encoded per chunk when streaming get_data results
+STREAM_BATCH_SIZE = 100
+
+# User fields read by login_user (_id is always included)
+LOGIN_USER_PROJECTION = {'username': 1, 'password': 1, 'prehashed': 1, 'role': 1}
+
+# Largest request body accepted by the authentication endpoints (bytes)
+MAX_AUTH_CONTENT_LENGTH = 4096
+
+# Compiled JSON schemas for the authentication request bodies
+_auth_properties = {
+    'username': {'type': 'string', 'maxLength': 128},
+    'password': {'type': 'string', 'maxLength': 256},
+}
+_login_validator = fastjsonschema.compile({
+    'type': 'object',
+    'required': ['username', 'password'],
+    'properties': _auth_properties,
+})
+_register_validator = fastjsonschema.compile({
+    'type': 'object',
+    'required': ['username', 'password', 'role'],
+    'properties': {**_auth_properties, 'role': {'type': 'string', 'maxLength': 64}},
+})
+
+# Reject oversized authentication bodies before they are parsed.
+# Bodies without a Content-Length (chunked transfer) are refused too, since their size is unknown until read.
+@app.before_request
+def limit_auth_content_length():
+    if not request.path.startswith('/api/auth/') or request.method != 'POST':
+        return None
+    if request.content_length is None:
+        return jsonify({"message": "Content-Length required"}), 411
+    if request.content_length > MAX_AUTH_CONTENT_LENGTH:
+        return jsonify({"message": "Request body too large"}), 413
+
 # Define the route for user login
 # @swagger
 # POST /api/auth/login
@@ -74,41 +128,49 @@ def register_user():
       200:
         description: Successful login, returns JWT token
       400:
-        description: Incorrect username or password
+        description: Invalid input, password does not meet complexity requirements, or user already exists
+      503:
+        description: Registration unavailable until the unique username index can be built
       500:
         description: Internal server error
     """
+    data = request.get_json(silent=True, cache=False)  # Get JSON data from the request (None if malformed)
     try:
-        data = request.get_json()  # Get JSON data from the request
-        if not data or 'username' not in data or 'password' not in data or 'role' not in data:
-          return jsonify({"error": "Invalid input"}), 400  # Return error if input is invalid
+        _register_validator(data)
+    except fastjsonschema.JsonSchemaException:
+        return jsonify({"error": "Invalid input"}), 400  # Return error if input is invalid
 
-        username = data['username'].lower()
-        password = data['password']
-        role = data['role']
+    username = data['username'].lower()  # Usernames are case-insensitive
+    password = data['password']
+    role = data['role']
 
-        logging.info(f"register_user();username={username}")
-        
-        user_exists = database.get_user({'name': username})
-        if user_exists:
-            return jsonify({"message": "User already exists"}), 400
+    logging.info("register_user();username=%s", username)
 
-        # encrypt password
-        hasedPassword = utilities.hash_password(password)
+    if not utilities.validate_password_rules(password):
+        return jsonify({"message": "Password does not meet complexity requirements"}), 400
 
-        new_user = {'username': username, 'password': hasedPassword, 'role': role}
-        
-        logging.info(f"register_user();new_user={str(new_user)}")
-        
-        created_user = str(database.add_user(new_user))
+    # Duplicate usernames are only rejected by the unique index, so registration waits until it exists
+    if not database.ensure_unique_username_index():
+        return jsonify({"message": "Registration is temporarily unavailable"}), 503
 
-        logging.info(f"register_user();created_user={created_user}")
+    # encrypt password
+    hasedPassword = utilities.hash_password(password)
 
-        return jsonify({"message": "User registered successfully", "user": created_user}), 201
+    # 'prehashed' marks hashes built from the SHA-256 pre-hashed password; older records lack it
+    new_user = {'username': username, 'password': hasedPassword, 'role': role, 'prehashed': True}
+    
+    # Payloads (password hashes, whole batches) are only logged at DEBUG
+    logging.debug("register_user();new_user=%s", new_user)
     
-    except Exception as e:
-        logging.error(f"register_user();Registration error: {e}")
-        return jsonify({"message": "Internal server error"}), 500
+    # The unique index on username rejects duplicates, so no separate existence check is needed
+    try:
+        created_user = database.add_user(new_user)
+    except DuplicateKeyError:
+        return jsonify({"message": "User already exists"}), 400
+
+    logging.info("register_user();created_user=%s", created_user)
+
+    return jsonify({"message": "User registered successfully", "user": created_user}), 201
 
 # Define the route for user registration
 # @swagger
@@ -147,42 +209,46 @@ def login_user():
       201:
         description: User registered successfully
       400:
-        description: Username and password are required, or user already exists
+        description: Invalid input, or invalid username or password
       500:
         description: Internal server error
     """
+    data = request.get_json(silent=True, cache=False)  # Get JSON data from the request (None if malformed)
     try:
-        data = request.get_json()  # Get JSON data from the request
-        if not data or 'username' not in data or 'password' not in data:
-          return jsonify({"error": "Invalid input"}), 400  # Return error if input is invalid
+        _login_validator(data)
+    except fastjsonschema.JsonSchemaException:
+        return jsonify({"error": "Invalid input"}), 400  # Return error if input is invalid
 
-        username = data['username'].lower()
-        password = data['password']
-    
-        logging.info(f"login_user();username={username}")
+    username = data['username'].lower()  # Usernames are case-insensitive
+    password = data['password']
+
+    logging.info("login_user();username=%s", username)
 
-        user = database.get_user({'username': username})
-        if not user:
-            return jsonify({"message": "User not found"}), 400
+    # Only fetch the fields used to check the password and sign the token
+    user = database.get_user({'username': username}, LOGIN_USER_PROJECTION)
 
-        logging.info(f"login_user();user={user}")
+    logging.debug("login_user();user=%s", user)
 
-        encryptPassword = user[0]['password']
-        
-        passwordMatch = utilities.validate_password(encryptPassword, password)
+    # Always run bcrypt, even for unknown users, so both paths take the same time
+    encryptPassword = user[0]['password'] if user else None
+    prehashed = user[0].get('prehashed', False) if user else True
+    
+    passwordMatch = utilities.validate_password(encryptPassword, password, prehashed)
+
+    logging.info("login_user();passwordMatch=%s", passwordMatch)
+    
+    # Unknown users and wrong passwords get the same response, so it does not reveal which accounts exist
+    authenticated = hmac.compare_digest(b"1" if (user and passwordMatch) else b"0", b"1")
+    if not authenticated:
+        return jsonify({"message": "Invalid username or password"}), 400
 
-        logging.info(f"login_user();passwordMatch={passwordMatch}")
-        
-        if not passwordMatch:
-            return jsonify({"message": "Incorrect password"}), 400
+    # Move legacy and lower-cost hashes to the current scheme on a successful login (stronger hashes are kept)
+    if utilities.needs_rehash(encryptPassword, prehashed):
+        database.update_user(user[0]['_id'], {'password': utilities.hash_password(password), 'prehashed': True})
 
-        token = utilities.create_token(user)
-        
-        return jsonify({"token": token}), 200
+    token = utilities.create_token(user)
     
-    except Exception as e:
-        logging.error(f"login_user();Login error: {e}")
-        return jsonify({"message": "Internal server error"}), 500
+    return jsonify({"token": token}), 200
 
 # Define the route for retrieving data
 # @swagger
@@ -233,26 +299,29 @@ def get_data():
       500:
         description: Internal server error
     """
-    try:
-        filter_data = request.args.to_dict()
-        logging.info(f"get_data();filter_data={filter_data}")
-        
-        all_data = None
-        
-        # Fetch all data using the singleton instance (database)
-        if not filter_data:
-            all_data = database.get_all_data()  # Call method on the instance
-        else:
-            all_data = database.get_all_data(filter_data)  # Call method on the instance
-            
-        if not all_data:
-            return jsonify([]), 200
-        
-        return jsonify(all_data), 200
+    filter_data = request.args.to_dict()
+    logging.info("get_data();filter_data=%s", filter_data)
     
-    except Exception as e:
-        logging.error(f"get_data();Error retrieving data: {e}")
-        return jsonify({"message": "Error retrieving data"}), 500
+    # Fetch a cursor over the matching data using the singleton instance (database)
+    all_data = iter(database.get_all_data(filter_data, stream=True))
+
+    # Read the first batch before the response starts, so query errors (e.g. MongoDB unreachable)
+    # still reach the app-wide error handler instead of truncating a 200 response
+    first_batch = list(islice(all_data, STREAM_BATCH_SIZE))
+
+    # Stream the JSON array as MongoDB returns documents, encoding them in batches:
+    # one orjson call per batch, with its surrounding brackets stripped, instead of one per document
+    def generate():
+        yield b'['
+        separator = b''
+        batch = first_batch
+        while batch:
+            yield separator + orjson.dumps(batch, default=str)[1:-1]
+            separator = b','
+            batch = list(islice(all_data, STREAM_BATCH_SIZE))
+        yield b']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json'), 200
 
 # Define the route for adding new data
 # @swagger
@@ -268,9 +337,11 @@ def get_data():
 #   {
 #     "content": "This is the content to be added."
 #   }
+# "content" may also be a list of records, which are inserted in a single batch.
 # Responses:
-#   201 Created: Data added successfully with a unique ID.
-#   400 Bad Request: If the 'content' field is missing or empty.
+#   201 Created: Data added successfully with a unique ID (or a list of IDs for a batch).
+#   400 Bad Request: If the 'content' field is missing or empty, a list contains records that are not objects or carry an '_id',
+#                    or a number does not fit in 64 bits.
 #   500 Internal Server Error: If an error occurs while adding data.
 @app.route('/api/data', methods=['POST'])
 def add_data():
@@ -290,7 +361,7 @@ def add_data():
           properties:
             content:
               type: string
-              description: The content to be added
+              description: The content to be added, or a list of records to add in one batch
               example: "This is some content to add"
     responses:
       201:
@@ -304,8 +375,13 @@ def add_data():
             id:
               type: string
               description: The ID of the added data
+            ids:
+              type: array
+              items:
+                type: string
+              description: The IDs of the added data, when a list was sent
       400:
-        description: Content is required
+        description: Content is required, a list of records is invalid, or a number does not fit in 64 bits
         schema:
           type: object
           properties:
@@ -321,21 +397,38 @@ def add_data():
               type: string
               description: Error message
     """
+    data = request.get_json(silent=True, cache=False)  # Get JSON data from the request (None if malformed)
+    content = data.get('content') if isinstance(data, dict) else None
+    if not content:
+        return jsonify({"message": "Content is required"}), 400
+
+    logging.debug("add_data()content=%s", content)
+
+    # Insert a list of records in one round trip
+    if isinstance(content, list):
+        # Every record must be an object, and ids are assigned by the database: a duplicate _id
+        # would otherwise fail the batch after the other records were already inserted
+        if not all(isinstance(item, dict) and '_id' not in item for item in content):
+            return jsonify({"message": "Invalid content"}), 400
+
+        try:
+            new_data_ids = database.add_data_many(content)  # Call method on the instance
+        except OverflowError:
+            return jsonify({"message": "Numbers must fit in 64 bits"}), 400
+
+        logging.debug("add_data()new_data_ids=%s", new_data_ids)
+
+        return jsonify({"message": "Data added", "ids": new_data_ids}), 201
+    
+    # MongoDB stores integers of at most 64 bits; larger ones are rejected instead of being rounded
     try:
-        content = request.json.get('content', {})
-        if not content:
-            return jsonify({"message": "Content is required"}), 400
-
-        logging.info(f"add_data()content={content}")
-        
-        new_data_id = str(database.add_data(content))  # Call method on the instance
-        
-        logging.info(f"add_data()new_data_id={new_data_id}")
-        
-        return jsonify({"message": "Data added", "id": new_data_id}), 201
-    except Exception as e:
-        logging.info(f"Error adding data: {e}")
-        return jsonify({"message": "Error adding data"}), 500
+        new_data_id = database.add_data(content)  # Call method on the instance
+    except OverflowError:
+        return jsonify({"message": "Numbers must fit in 64 bits"}), 400
+    
+    logging.info("add_data()new_data_id=%s", new_data_id)
+    
+    return jsonify({"message": "Data added", "id": new_data_id}), 201
 
 # Define the route for deleting data by ID
 # @swagger
@@ -347,6 +440,7 @@ def add_data():
 #   DELETE /api/data/12345
 # Responses:
 #   204 No Content: Data deleted successfully, no content returned.
+#   400 Bad Request: If the ID is not a valid ObjectId.
 #   404 Not Found: If the data with the given ID does not exist.
 #   500 Internal Server Error: If an error occurs while processing the request.
 @app.route('/api/data/<string:id>', methods=['DELETE'])
@@ -365,6 +459,14 @@ def delete_data(id):
     responses:
       204:
         description: Data deleted successfully (no content returned)
+      400:
+        description: Invalid ID
+        schema:
+          type: object
+          properties:
+            message:
+              type: string
+              description: Error message
       404:
         description: Data not found
         schema:
@@ -382,19 +484,96 @@ def delete_data(id):
               type: string
               description: Error message
     """
-    try:
-        logging.info(f"delete_data()id={id}")
-        
-        delete_result = database.delete_data(id)  # Call method on the instance
-        if delete_result.deleted_count == 0:
-            return jsonify({"message": "Data not found"}), 404
+    logging.info("delete_data()id=%s", id)
 
-        return '', 204
+    # Reject malformed ids before they reach the database
+    if not ObjectId.is_valid(id):
+        return jsonify({"message": "Invalid id"}), 400
     
-    except Exception as e:
-        print(f"Error deleting data: {e}")
-        return jsonify({"message": "Error deleting data"}), 500
+    deleted_data = database.delete_data(ObjectId(id))  # Call method on the instance
+    if deleted_data is None:
+        return jsonify({"message": "Data not found"}), 404
+
+    return '', 204
+
+# Define the route for deleting several data records by ID
+# @swagger
+# DELETE /api/data
+# This endpoint deletes several data records in one request.
+# The request body must contain a JSON object with the following structure:
+# {
+#   "ids": ["id1", "id2"]  # The IDs of the data to be deleted (list of strings)
+# }
+# Responses:
+#   200 OK: Returns the number of deleted records.
+#   400 Bad Request: If 'ids' is missing, empty, or contains an invalid ObjectId.
+#   500 Internal Server Error: If an error occurs while processing the request.
+@app.route('/api/data', methods=['DELETE'])
+def delete_many_data():
+    """
+    Deletes several data records by ID.
+    ---
+    tags:
+      - Data
+    parameters:
+      - in: body
+        name: body
+        description: JSON object containing the IDs of the data to be deleted
+        schema:
+          type: object
+          required:
+            - ids
+          properties:
+            ids:
+              type: array
+              items:
+                type: string
+              example: ["64b7f0c2a1b2c3d4e5f60718"]
+    responses:
+      200:
+        description: Number of deleted records
+        schema:
+          type: object
+          properties:
+            deleted:
+              type: integer
+              description: The number of deleted records
+      400:
+        description: Invalid IDs
+        schema:
+          type: object
+          properties:
+            message:
+              type: string
+              description: Error message
+      500:
+        description: Internal server error
+        schema:
+          type: object
+          properties:
+            message:
+              type: string
+              description: Error message
+    """
+    data = request.get_json(silent=True, cache=False)  # Get JSON data from the request (None if malformed)
+    ids = data.get('ids') if isinstance(data, dict) else None
+
+    logging.debug("delete_many_data()ids=%s", ids)
+
+    # Reject the whole request if any id is malformed
+    if not ids or not isinstance(ids, list) or not all(isinstance(i, str) and ObjectId.is_valid(i) for i in ids):
+        return jsonify({"message": "Invalid ids"}), 400
+
+    deleted_count = database.delete_many_data(ids)  # Call method on the instance
+
+    return jsonify({"deleted": deleted_count}), 200
+
+# Build the Swagger spec once at startup so the first /apidocs request does not parse every docstring
+with app.test_request_context():
+    swagger.get_apispecs()
 
+# Development server only; in production run gunicorn with wsgi.py (see gunicorn.conf.py)
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 3001))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    # The Werkzeug debugger is opt-in (FLASK_DEBUG=1), since the server listens on all interfaces
+    app.run(host='0.0.0.0', port=port, debug=os.getenv('FLASK_DEBUG', '0') == '1')
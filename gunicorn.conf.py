@@ -0,0 +1,20 @@
+# Gunicorn configuration for running the app in production
+# Usage: gunicorn -c gunicorn.conf.py wsgi:app
+import multiprocessing
+import os
+
+# Address and port to listen on
+bind = f"0.0.0.0:{os.getenv('PORT', '3001')}"
+
+# Worker processes (2 * CPU + 1), each serving requests on a pool of threads
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+# Load the app once in the master so module-level state is shared copy-on-write by the workers
+preload_app = True
+
+def post_fork(server, worker):
+    # Give each worker its own MongoDB connection pool instead of the one inherited from the master
+    from utils.database import database
+    database.reconnect()
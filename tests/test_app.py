@@ -1,9 +1,14 @@
+import io
+import os
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 from flask import json
+from pymongo.errors import ServerSelectionTimeoutError
+
+# Utils needs an encryption key at import time
+os.environ.setdefault('ENCRYPTION_KEY', 'test-encryption-key')
+
 from app import app
-import mongomock
-from pymongo import MongoClient
 
 class TestApp(unittest.TestCase):
     @classmethod
@@ -12,26 +17,30 @@ class TestApp(unittest.TestCase):
         cls.client = app.test_client()
         cls.client.testing = True
         
-        # Mock MongoDB connection
-        cls.patched_client = patch('pymongo.MongoClient', new=mongomock.MongoClient)
-        cls.patched_client.start()
+        # Mock the database and utilities singletons used by the app once for the whole class
+        cls._db_patch = patch('app.database')
+        cls.mock_database = cls._db_patch.start()
+        cls.addClassCleanup(cls._db_patch.stop)
 
-    @classmethod
-    def tearDownClass(cls):
-        cls.patched_client.stop()
+        cls._utilities_patch = patch('app.utilities')
+        cls.mock_utilities = cls._utilities_patch.start()
+        cls.addClassCleanup(cls._utilities_patch.stop)
 
-    @patch('utils.database.database')
-    @patch('utils.utilities')
-    def test_register_user(self, mock_utilities, mock_database):
+    def setUp(self):
+        # Clear return values and side effects left by the previous test
+        self.mock_database.reset_mock(return_value=True, side_effect=True)
+        self.mock_utilities.reset_mock(return_value=True, side_effect=True)
+
+    def test_register_user(self):
         # Mock utility methods and database responses
-        mock_utilities.validate_password_rules.return_value = True
-        mock_database.get_user.return_value = None
-        mock_database.add_user.return_value = {'inserted_id': 'mock_id'}
+        self.mock_utilities.validate_password_rules.return_value = True
+        self.mock_utilities.hash_password.return_value = 'hashed_password'
+        self.mock_database.add_user.return_value = 'mock_id'
 
         # Simulate valid registration request
         response = self.client.post(
             '/api/auth/register',
-            data=json.dumps({'username': 'testuser', 'password': 'Password123'}),
+            data=json.dumps({'username': 'testuser', 'password': 'Password123', 'role': 'user'}),
             content_type='application/json'
         )
         self.assertEqual(response.status_code, 201)
@@ -40,24 +49,35 @@ class TestApp(unittest.TestCase):
         # Edge case: Empty request body
         response = self.client.post('/api/auth/register', data=json.dumps({}), content_type='application/json')
         self.assertEqual(response.status_code, 400)
-        self.assertEqual(response.json['message'], "Username and password are required")
+        self.assertEqual(response.json['error'], "Invalid input")
 
         # Edge case: Password does not meet complexity requirements
-        mock_utilities.validate_password_rules.return_value = False
+        self.mock_utilities.validate_password_rules.return_value = False
         response = self.client.post(
             '/api/auth/register',
-            data=json.dumps({'username': 'testuser', 'password': 'weakpass'}),
+            data=json.dumps({'username': 'testuser', 'password': 'weakpass', 'role': 'user'}),
             content_type='application/json'
         )
         self.assertEqual(response.status_code, 400)
         self.assertEqual(response.json['message'], "Password does not meet complexity requirements")
 
-    @patch('utils.database.database')
-    @patch('utils.utilities')
-    def test_login_user(self, mock_utilities, mock_database):
+        # Edge case: The unique username index is missing (e.g. duplicate usernames in existing data)
+        self.mock_utilities.validate_password_rules.return_value = True
+        self.mock_database.ensure_unique_username_index.return_value = False
+        response = self.client.post(
+            '/api/auth/register',
+            data=json.dumps({'username': 'testuser', 'password': 'Password123', 'role': 'user'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 503)
+        self.mock_database.add_user.assert_called_once()
+
+    def test_login_user(self):
         # Mock valid user data and password hash
-        mock_database.get_user.return_value = [{'name': 'testuser', 'password': 'hashed_password'}]
-        mock_utilities.create_token.return_value = 'mocked_jwt_token'
+        self.mock_database.get_user.return_value = [{'username': 'testuser', 'password': 'hashed_password'}]
+        self.mock_utilities.validate_password.return_value = True
+        self.mock_utilities.create_token.return_value = 'mocked_jwt_token'
+        self.mock_utilities.needs_rehash.return_value = False
 
         # Simulate valid login request
         response = self.client.post(
@@ -67,25 +87,71 @@ class TestApp(unittest.TestCase):
         )
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json['token'], 'mocked_jwt_token')
+        self.mock_database.update_user.assert_not_called()
+        self.mock_database.get_user.assert_called_once_with(
+            {'username': 'testuser'}, {'username': 1, 'password': 1, 'prehashed': 1, 'role': 1}
+        )
+
+        # A legacy or old-cost hash is replaced after a successful login
+        self.mock_database.get_user.return_value = [{'_id': 'mock_id', 'username': 'testuser', 'password': 'legacy_hash'}]
+        self.mock_utilities.needs_rehash.return_value = True
+        self.mock_utilities.hash_password.return_value = 'new_hash'
+        response = self.client.post(
+            '/api/auth/login',
+            data=json.dumps({'username': 'testuser', 'password': 'Password123'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.mock_utilities.needs_rehash.assert_called_with('legacy_hash', False)
+        self.mock_database.update_user.assert_called_once_with('mock_id', {'password': 'new_hash', 'prehashed': True})
 
         # Edge case: Empty request body
         response = self.client.post('/api/auth/login', data=json.dumps({}), content_type='application/json')
         self.assertEqual(response.status_code, 400)
-        self.assertEqual(response.json['message'], "User not found")
+        self.assertEqual(response.json['error'], "Invalid input")
 
         # Edge case: Incorrect password
+        self.mock_utilities.validate_password.return_value = False
         response = self.client.post(
             '/api/auth/login',
             data=json.dumps({'username': 'testuser', 'password': 'WrongPassword'}),
             content_type='application/json'
         )
         self.assertEqual(response.status_code, 400)
-        self.assertEqual(response.json['message'], "Incorrect password")
+        self.assertEqual(response.json['message'], "Invalid username or password")
 
-    @patch('utils.database.database')
-    def test_get_data(self, mock_database):
+        # Edge case: Unknown user
+        self.mock_database.get_user.return_value = []
+        response = self.client.post(
+            '/api/auth/login',
+            data=json.dumps({'username': 'nobody', 'password': 'Password123'}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['message'], "Invalid username or password")
+
+    def test_auth_content_length(self):
+        # Edge case: Body larger than MAX_AUTH_CONTENT_LENGTH
+        response = self.client.post(
+            '/api/auth/login',
+            data=json.dumps({'username': 'testuser', 'password': 'x' * 5000}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 413)
+
+        # Edge case: Chunked body without a Content-Length
+        response = self.client.post(
+            '/api/auth/login',
+            input_stream=io.BytesIO(json.dumps({'username': 'testuser', 'password': 'Password123'}).encode()),
+            headers={'Transfer-Encoding': 'chunked'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 411)
+        self.mock_database.get_user.assert_not_called()
+
+    def test_get_data(self):
         # Mock valid data retrieval
-        mock_database.get_all_data.return_value = [{'id': '1', 'content': 'Test data'}]
+        self.mock_database.get_all_data.return_value = [{'id': '1', 'content': 'Test data'}]
 
         # Simulate GET request to /api/data
         response = self.client.get('/api/data')
@@ -94,17 +160,20 @@ class TestApp(unittest.TestCase):
         self.assertEqual(response.json[0]['content'], 'Test data')
 
         # Edge case: No data found (empty list)
-        mock_database.get_all_data.return_value = []
+        self.mock_database.get_all_data.return_value = []
         response = self.client.get('/api/data')
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.json, [])
 
-    @patch('utils.database.database')
-    def test_add_data(self, mock_database):
-        # Mock the database insertion to return a valid result
-        mock_insert_result = MagicMock()
-        mock_insert_result.inserted_id = 'mocked_id'
-        mock_database.add_data.return_value = mock_insert_result
+        # Results spanning several stream batches are joined into one JSON array
+        self.mock_database.get_all_data.return_value = iter([{'id': str(i)} for i in range(250)])
+        response = self.client.get('/api/data')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json], [str(i) for i in range(250)])
+
+    def test_add_data(self):
+        # Mock the database insertion to return the inserted ID
+        self.mock_database.add_data.return_value = 'mocked_id'
 
         mockData = {
             'description': 'description',
@@ -125,32 +194,106 @@ class TestApp(unittest.TestCase):
         
         # Assert that the response status code is 201 (Created)
         self.assertEqual(response.status_code, 201)
-        self.assertEqual(response.json['message'], "Data added successfully")
+        self.assertEqual(response.json['message'], "Data added")
+        self.assertEqual(response.json['id'], 'mocked_id')
 
-    @patch('utils.database.database')
-    def test_delete_data(self, mock_database):
-        # Mock successful data deletion
-        mock_database.delete_data.return_value = MagicMock(deleted_count=1)
+        # Simulate a batch POST request with a list of records
+        self.mock_database.add_data_many.return_value = ['mocked_id_1', 'mocked_id_2']
+        response = self.client.post(
+            '/api/data',
+            data=json.dumps({'content': [mockData, mockData]}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json['ids'], ['mocked_id_1', 'mocked_id_2'])
 
-        # Simulate valid DELETE request to /api/data/1
-        response = self.client.delete('/api/data/1')
+        # Edge case: A list with records that are not objects or that carry their own _id
+        for content in ([1, 2], [mockData, {**mockData, '_id': '64b7f0c2a1b2c3d4e5f60718'}]):
+            response = self.client.post(
+                '/api/data',
+                data=json.dumps({'content': content}),
+                content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json['message'], "Invalid content")
+        self.mock_database.add_data_many.assert_called_once()
+
+    def test_large_integers(self):
+        # Integers beyond 64 bits are parsed exactly (orjson would turn them into floats)
+        self.mock_database.add_data.side_effect = OverflowError('MongoDB can only handle up to 8-byte ints')
+        response = self.client.post(
+            '/api/data',
+            data='{"content": {"value": 123456789012345678901234567890}}',
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['message'], "Numbers must fit in 64 bits")
+        self.mock_database.add_data.assert_called_once_with({'value': 123456789012345678901234567890})
+
+        # ... and written exactly in responses
+        response = app.json.response({'value': 2 ** 64})
+        self.assertEqual(response.get_data(), b'{"value":18446744073709551616}')
+
+    def test_delete_data(self):
+        # Mock successful data deletion (the deleted document is returned)
+        self.mock_database.delete_data.return_value = {'_id': '64b7f0c2a1b2c3d4e5f60718', 'content': 'Test data'}
+
+        # Simulate valid DELETE request
+        response = self.client.delete('/api/data/64b7f0c2a1b2c3d4e5f60718')
         self.assertEqual(response.status_code, 204)
 
-        # Edge case: Data not found (deleted_count == 0)
-        mock_database.delete_data.return_value = MagicMock(deleted_count=0)
-        response = self.client.delete('/api/data/2')
+        # Edge case: Data not found (no document deleted)
+        self.mock_database.delete_data.return_value = None
+        response = self.client.delete('/api/data/64b7f0c2a1b2c3d4e5f60719')
         self.assertEqual(response.status_code, 404)
         self.assertEqual(response.json['message'], 'Data not found')
 
-    @patch('utils.database.database')
-    def test_internal_server_error(self, mock_database):
+        # Edge case: Invalid ID
+        response = self.client.delete('/api/data/1')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['message'], 'Invalid id')
+
+    def test_delete_many_data(self):
+        # Mock successful deletion of two records
+        self.mock_database.delete_many_data.return_value = 2
+
+        # Simulate valid DELETE request to /api/data
+        response = self.client.delete(
+            '/api/data',
+            data=json.dumps({'ids': ['64b7f0c2a1b2c3d4e5f60718', '64b7f0c2a1b2c3d4e5f60719']}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['deleted'], 2)
+
+        # Edge case: One of the IDs is invalid
+        response = self.client.delete(
+            '/api/data',
+            data=json.dumps({'ids': ['64b7f0c2a1b2c3d4e5f60718', 'not-an-id']}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json['message'], 'Invalid ids')
+
+    def test_internal_server_error(self):
         # Simulate database exception
-        mock_database.get_all_data.side_effect = Exception('Database error')
+        self.mock_database.get_all_data.side_effect = Exception('Database error')
 
         # Simulate GET request to /api/data with an exception occurring
         response = self.client.get('/api/data')
         self.assertEqual(response.status_code, 500)
-        self.assertEqual(response.json['message'], 'Error retrieving data')
+        self.assertEqual(response.json['message'], 'Internal server error')
+
+        # A real cursor only queries MongoDB when iterated, so errors must still produce a 500
+        def failing_cursor():
+            raise ServerSelectionTimeoutError('No servers available')
+            yield
+
+        self.mock_database.get_all_data.side_effect = None
+        self.mock_database.get_all_data.return_value = failing_cursor()
+        response = self.client.get('/api/data')
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json['message'], 'Internal server error')
 
 if __name__ == '__main__':
     unittest.main()
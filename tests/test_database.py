@@ -1,24 +1,38 @@
+import os
+import time
 import unittest
-from unittest.mock import patch, MagicMock
-from pymongo import MongoClient
-from database import Database  # Adjust this import based on your file structure
+import mongomock
+from unittest.mock import Mock, patch
+from pymongo.errors import DuplicateKeyError, PyMongoError, ServerSelectionTimeoutError
+
+# Utils needs an encryption key at import time
+os.environ.setdefault('ENCRYPTION_KEY', 'test-encryption-key')
+
+from utils.database import CONNECT_RETRY_BACKOFF, Database
 
 class TestDatabase(unittest.TestCase):
-    @patch('pymongo.MongoClient', new_callable=MagicMock)
-    def setUp(self, mock_mongo_client):
-        # Mock the MongoClient to use mongomock
-        self.database = Database()
-        self.database.client = mock_mongo_client.return_value
-        self.database.db = self.database.client['test_db']
-        self.database.users = self.database.db['users']
-        self.database.data = self.database.db['data']
-        self.database.logs = self.database.db['logs']
+    @classmethod
+    def setUpClass(cls):
+        # Create the Database once (no connection is opened), backed by an in-memory mongomock client
+        cls.database = Database()
+        cls.database.client = mongomock.MongoClient()
+        cls.database.db = cls.database.client['test_db']
+        cls.database.users = cls.database.db['users']
+        cls.database.data = cls.database.db['data']
+        cls.database.logs = cls.database.db['logs']
         
+        # Drop the mongomock connection afterwards so the shared singleton connects lazily again
+        cls.addClassCleanup(cls.database.reconnect)
+
+    def setUp(self):
+        # Start every test with empty collections
+        self.database.users.delete_many({})
+        self.database.data.delete_many({})
+
     def test_add_user(self):
         user = {"username": "testuser", "email": "test@example.com"}
         result = self.database.add_user(user)
-        self.assertEqual(len(result), 1)
-        self.assertEqual(result[0]['username'], "testuser")
+        self.assertEqual(self.database.users.find_one({"_id": result})['username'], "testuser")
 
     def test_get_user(self):
         user = {"username": "testuser", "email": "test@example.com"}
@@ -28,11 +42,28 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(len(result), 1)
         self.assertEqual(result[0]['username'], "testuser")
 
+        # Only the projected fields (and _id) are returned
+        result = self.database.get_user({"username": "testuser"}, {"username": 1})
+        self.assertEqual(set(result[0]), {"_id", "username"})
+
+    def test_update_user(self):
+        id = self.database.users.insert_one({"username": "testuser", "password": "old_hash"}).inserted_id
+        
+        self.assertTrue(self.database.update_user(str(id), {"password": "new_hash", "prehashed": True}))
+        self.assertEqual(self.database.users.find_one({"_id": id})['password'], "new_hash")
+        self.assertFalse(self.database.update_user("64b7f0c2a1b2c3d4e5f60718", {"password": "new_hash"}))
+
     def test_add_data(self):
         data = {"info": "test data"}
         result = self.database.add_data(data)
-        self.assertEqual(len(result), 1)
-        self.assertEqual(result[0]['info'], "test data")
+        self.assertEqual(self.database.data.find_one({"_id": result})['info'], "test data")
+
+    def test_add_data_many(self):
+        docs = [{"info": "first"}, {"info": "second"}]
+        result = self.database.add_data_many(docs)
+        
+        self.assertEqual(len(result), 2)
+        self.assertEqual([self.database.data.find_one({"_id": id})['info'] for id in result], ["first", "second"])
 
     def test_get_all_data(self):
         data = {"info": "test data"}
@@ -50,8 +81,7 @@ class TestDatabase(unittest.TestCase):
         updated_data = {"info": "updated data"}
         result = self.database.update_data(str(id), updated_data)
         
-        self.assertEqual(len(result), 1)
-        self.assertEqual(result[0]['info'], "updated data")
+        self.assertEqual(result['info'], "updated data")
 
     def test_delete_data(self):
         data = {"info": "test data"}
@@ -60,7 +90,61 @@ class TestDatabase(unittest.TestCase):
         
         result = self.database.delete_data(str(id))
         
-        self.assertIsNone(result)
+        self.assertEqual(result['info'], "test data")
+        self.assertIsNone(self.database.delete_data(str(id)))
+
+    def test_delete_many_data(self):
+        ids = self.database.data.insert_many([{"info": "first"}, {"info": "second"}, {"info": "third"}]).inserted_ids
+        
+        # Ids are accepted as strings; unknown ids are ignored
+        result = self.database.delete_many_data([str(ids[0]), str(ids[1]), "64b7f0c2a1b2c3d4e5f60718"])
+        
+        self.assertEqual(result, 2)
+        self.assertEqual([doc['info'] for doc in self.database.data.find()], ["third"])
+
+    def test_unique_username_index_is_retried(self):
+        # Existing duplicate usernames make the unique index build fail
+        client = mongomock.MongoClient()
+        users = client['test_init_db']['users']
+        users.insert_many([{"username": "bob"}, {"username": "bob"}])
+
+        # A separate, unconnected instance (bypassing the singleton)
+        database = object.__new__(Database)
+        with patch('utils.database.MongoClient', return_value=client), \
+                patch.dict(os.environ, {'DATABASE_NAME': 'test_init_db'}):
+            # The connection still opens, but registration is refused without the index
+            self.assertEqual(len(database.get_user({"username": "bob"})), 2)
+            self.assertFalse(database.ensure_unique_username_index())
+
+            # Once the duplicate is removed, the index is built and rejects duplicates
+            users.delete_one({"username": "bob"})
+            self.assertTrue(database.ensure_unique_username_index())
+            with self.assertRaises(DuplicateKeyError):
+                database.users.insert_one({"username": "bob"})
+
+    def test_init_db_backs_off_after_a_failure(self):
+        # MongoDB unreachable on the first attempt, available afterwards
+        client = mongomock.MongoClient()
+        failing_client = mongomock.MongoClient()
+        failing_client.admin.command = Mock(side_effect=ServerSelectionTimeoutError('No servers available'))
+
+        # A separate, unconnected instance (bypassing the singleton)
+        database = object.__new__(Database)
+        with patch('utils.database.MongoClient', side_effect=[failing_client, client]) as mongo_client, \
+                patch.dict(os.environ, {'DATABASE_NAME': 'test_init_db'}):
+            with self.assertRaises(ServerSelectionTimeoutError):
+                database.users
+            self.assertNotIn('client', database.__dict__)
+
+            # Within the backoff, accesses fail without a new connection attempt
+            with self.assertRaises(PyMongoError):
+                database.data
+            self.assertEqual(mongo_client.call_count, 1)
+
+            # After the backoff, the next access connects
+            with patch('utils.database.time.monotonic', return_value=time.monotonic() + CONNECT_RETRY_BACKOFF):
+                self.assertIs(database.client, client)
+            self.assertEqual(mongo_client.call_count, 2)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,127 @@
+import os
+import time
+import unittest
+from unittest.mock import patch
+import jwt
+from bcrypt import gensalt, hashpw
+from bson import ObjectId
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+# Utils needs an encryption key at import time
+os.environ.setdefault('ENCRYPTION_KEY', 'test-encryption-key')
+
+from utils import utilities
+from utils import utils as utils_module
+
+class TestUtils(unittest.TestCase):
+    def setUp(self):
+        # Start every test with empty token caches
+        utils_module._token_cache.clear()
+        utils_module._verified_token_cache.clear()
+        self.user = [{'_id': ObjectId(), 'username': 'testuser', 'role': 'user'}]
+
+    def test_create_token(self):
+        token = utilities.create_token(self.user)
+
+        # For ASCII payloads, the hand-signed token matches PyJWT's encoding and verifies
+        expected = jwt.encode(
+            {'id': str(self.user[0]['_id']), 'username': 'testuser'}, os.environ['ENCRYPTION_KEY'], algorithm='HS256'
+        )
+        self.assertEqual(token, expected)
+        self.assertEqual(utilities.verify_token(token), {'id': str(self.user[0]['_id']), 'username': 'testuser'})
+
+        # The signed token is cached per user
+        self.assertIs(utilities.create_token(self.user), token)
+        other_user = [{**self.user[0], 'username': 'otheruser'}]
+        self.assertNotEqual(utilities.create_token(other_user), token)
+
+    def test_create_token_non_ascii(self):
+        # orjson writes non-ASCII characters as raw UTF-8 (PyJWT escapes them), so the token differs
+        # from jwt.encode but decodes to the same payload
+        user = [{**self.user[0], 'username': 'josé'}]
+        token = utilities.create_token(user)
+
+        payload = jwt.decode(token, os.environ['ENCRYPTION_KEY'], algorithms=['HS256'])
+        self.assertEqual(payload, {'id': str(user[0]['_id']), 'username': 'josé'})
+        self.assertEqual(utilities.verify_token(token), payload)
+
+    def test_verify_token(self):
+        token = utilities.create_token(self.user)
+
+        # A verified token is served from the cache, as a copy the caller may modify
+        with patch('utils.utils.jwt.decode', wraps=jwt.decode) as decode:
+            payload = utilities.verify_token(token)
+            payload['username'] = 'changed'
+            self.assertEqual(utilities.verify_token(token)['username'], 'testuser')
+        decode.assert_called_once()
+
+        # Edge case: Missing, tampered and expired tokens
+        self.assertIsNone(utilities.verify_token(None))
+        signing_input, signature = token.rsplit('.', 1)
+        self.assertIsNone(utilities.verify_token(signing_input + '.' + ('B' if signature[0] == 'A' else 'A') + signature[1:]))
+        expired = jwt.encode({'username': 'testuser', 'exp': int(time.time()) - 10}, os.environ['ENCRYPTION_KEY'], algorithm='HS256')
+        self.assertIsNone(utilities.verify_token(expired))
+
+        # Edge case: A cached payload whose 'exp' has passed is verified again (and rejected)
+        utils_module._verified_token_cache[expired] = {'username': 'testuser', 'exp': int(time.time()) - 10}
+        self.assertIsNone(utilities.verify_token(expired))
+
+    def test_encrypt_decrypt(self):
+        encrypted = utilities.encrypt('secret text')
+        self.assertNotEqual(encrypted, utilities.encrypt('secret text'))  # Random nonce per call
+        self.assertEqual(utilities.decrypt(encrypted), 'secret text')
+        self.assertEqual(utilities.decrypt(''), '')
+
+        # Edge case: A tampered ciphertext fails authentication
+        iv, ciphertext = encrypted.split(':')
+        tampered = iv + ':' + ('0' if ciphertext[0] != '0' else '1') + ciphertext[1:]
+        with self.assertRaises(Exception):
+            utilities.decrypt(tampered)
+
+    def test_decrypt_legacy_cbc(self):
+        # Values encrypted with the older AES-CBC scheme (16-byte IV, PKCS#7 padding) are still readable
+        iv = os.urandom(16)
+        plaintext = 'legacy text'.encode()
+        padding_length = 16 - len(plaintext) % 16
+        encryptor = Cipher(algorithms.AES(utilities.ENCRYPTION_KEY), modes.CBC(iv)).encryptor()
+        encrypted = encryptor.update(plaintext + bytes([padding_length]) * padding_length) + encryptor.finalize()
+
+        self.assertEqual(utilities.decrypt(iv.hex() + ':' + encrypted.hex()), 'legacy text')
+
+    def test_validate_password_rules(self):
+        self.assertTrue(utilities.validate_password_rules('Password123'))
+        self.assertFalse(utilities.validate_password_rules('Pass123'))  # Too short
+        self.assertFalse(utilities.validate_password_rules('password123'))  # No uppercase letter
+        self.assertFalse(utilities.validate_password_rules('PASSWORD123'))  # No lowercase letter
+        self.assertFalse(utilities.validate_password_rules('PasswordABC'))  # No digit
+
+    def test_validate_password(self):
+        # Pre-hashed bcrypt hashes, including passwords longer than bcrypt's 72-byte limit
+        long_password = 'Password123' + 'x' * 100
+        stored_hash = utilities.hash_password(long_password)
+        self.assertTrue(utilities.validate_password(stored_hash, long_password))
+        self.assertFalse(utilities.validate_password(stored_hash, long_password[:72]))
+        self.assertFalse(utilities.validate_password(stored_hash, long_password, prehashed=False))
+
+        # Legacy hashes of the raw password bytes, which only ever covered the first 72 bytes
+        legacy_hash = hashpw(long_password.encode(), gensalt(rounds=4)).decode()
+        self.assertTrue(utilities.validate_password(legacy_hash, long_password, prehashed=False))
+        self.assertTrue(utilities.validate_password(legacy_hash, long_password[:72] + 'y', prehashed=False))
+        self.assertFalse(utilities.validate_password(legacy_hash, 'Password123', prehashed=False))
+
+        # Edge case: Unknown user (no stored hash) never matches
+        self.assertFalse(utilities.validate_password(None, 'Password123'))
+
+    def test_needs_rehash(self):
+        self.assertFalse(utilities.needs_rehash(utilities.hash_password('Password123')))
+        self.assertTrue(utilities.needs_rehash(utilities.hash_password('Password123'), prehashed=False))
+        self.assertTrue(utilities.needs_rehash(hashpw(b'Password123', gensalt(rounds=4)).decode()))
+
+        # Stronger hashes (e.g. cost 12 from gensalt()'s old default) are never downgraded
+        self.assertFalse(utilities.needs_rehash(hashpw(b'Password123', gensalt(rounds=utils_module.BCRYPT_COST + 1)).decode()))
+
+        # Unknown usernames cost at least as much bcrypt work as the strongest stored hash
+        self.assertGreaterEqual(int(utils_module.DUMMY_HASH.split(b'$')[2]), max(utils_module.BCRYPT_COST, 12))
+
+if __name__ == '__main__':
+    unittest.main()
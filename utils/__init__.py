@@ -3,3 +3,9 @@ from utils.utils import Utils
 
 # Create a singleton instance of the Utils class for global access throughout the application
 utilities = Utils()
+
+# Module-level shortcuts to the singleton's methods (e.g. from utils import create_token)
+encrypt = utilities.encrypt
+decrypt = utilities.decrypt
+create_token = utilities.create_token
+verify_token = utilities.verify_token
@@ -1,11 +1,16 @@
 # Import necessary modules and libraries
 # os: for accessing environment variables
+# threading: to guard the lazy database initialization
+# time: to back off after a failed connection attempt
 # MongoClient: to connect to a MongoDB database
 # ObjectId: to work with MongoDB document IDs
 # load_dotenv: to load environment variables from a .env file
 # logging: to log messages for debugging and monitoring
 import os
-from pymongo import MongoClient
+import threading
+import time
+from pymongo import MongoClient, ReturnDocument
+from pymongo.errors import PyMongoError
 from bson.objectid import ObjectId
 from dotenv import load_dotenv
 from utils.logging import logging
@@ -14,6 +19,13 @@ from utils import utilities
 # Load environment variables from the .env file
 load_dotenv()
 
+# Number of documents fetched per round trip when iterating large cursors
+CURSOR_BATCH_SIZE = 1000
+
+# Seconds during which accesses fail immediately after a failed connection attempt,
+# instead of each waiting for its own server selection timeout
+CONNECT_RETRY_BACKOFF = float(os.getenv("MONGO_CONNECT_RETRY_BACKOFF", "10"))
+
 class Database:
     """
     A singleton class to manage the connection to MongoDB and perform database operations.
@@ -23,23 +35,55 @@ class Database:
     # Static property to hold the single instance of the class
     _instance = None
 
+    # Attributes set by _init_db; the connection is only opened the first time one of them is used
+    _CONNECTION_ATTRIBUTES = ('client', 'db', 'users', 'data', 'logs', 'unique_username_index')
+    _init_lock = threading.RLock()
+
+    # Time (time.monotonic) and error of the last failed connection attempt
+    _init_failure = None
+
     def __new__(cls):
         """
         Override the default __new__ method to implement the singleton pattern.
-        If an instance of the class doesn't exist, create and initialize it.
+        If an instance of the class doesn't exist, create it. The database connection
+        is opened lazily, so importing this module never contacts MongoDB.
         """
         if cls._instance is None:
             cls._instance = super(Database, cls).__new__(cls)
-            cls._instance._init_db()  # Initialize the database connection
             
             logging.info('Initialize Database')  # Log that the database has been initialized
         
         return cls._instance
 
+    def __getattr__(self, name):
+        """
+        Called only for attributes that are not set yet: initializes the database
+        connection on first use of the client, database or a collection.
+        """
+        if name not in self._CONNECTION_ATTRIBUTES:
+            raise AttributeError(name)
+        
+        with self._init_lock:
+            if name not in self.__dict__:
+                # While MongoDB is unreachable, fail fast rather than queueing every request behind a new ping
+                if self._init_failure and time.monotonic() - self._init_failure[0] < CONNECT_RETRY_BACKOFF:
+                    raise PyMongoError(f"MongoDB unavailable, retrying later: {self._init_failure[1]}")
+                
+                try:
+                    self._init_db()  # Initialize the database connection
+                except PyMongoError as e:
+                    self._init_failure = (time.monotonic(), e)
+                    raise
+                self._init_failure = None
+        
+        return self.__dict__[name]
+
     def _init_db(self):
         """
         Initialize the database connection using the MongoDB URI and database name 
         from environment variables. Log the connection status and select the required collections.
+        The connection attributes are only set once MongoDB answered; on failure the client
+        is closed and the error raised, so the next access retries.
         """
         
         # Load MongoDB connection string and database name from environment variables
@@ -50,21 +94,83 @@ class Database:
         logging.info(f"_init_db();mongo_uri={mongo_uri}")
         logging.info(f"_init_db();mongo_database={mongo_database}")
         
-        # Establish connection to MongoDB
-        self.client = MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+        # Establish connection to MongoDB with a pooled client shared by all requests
+        client = MongoClient(
+            mongo_uri,
+            maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+            minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", "10")),
+            waitQueueTimeoutMS=2000,
+            socketTimeoutMS=5000,
+            serverSelectionTimeoutMS=5000,
+            retryWrites=True,
+            compressors=os.getenv("MONGO_COMPRESSORS", "zstd,zlib"),  # Compress wire traffic (zstd needs the zstandard package)
+            appname="accounting-server",
+        )
         
-        # Ping the database to check if the connection is successful
-        self.client.admin.command('ping')
-        is_connected = True  # Variable indicating successful connection
-        logging.info("_init_db();MongoDB connected successfully.")
+        try:
+            # Ping the database to check if the connection is successful
+            client.admin.command('ping')
+            logging.info("_init_db();MongoDB connected successfully.")
+            
+            # Select the database and the collections used by the app
+            db = client[mongo_database]
+            users = db["users"]
+            data = db["data"]
+        except PyMongoError as e:
+            logging.critical(f"_init_db();MongoDB initialization failed={e}")
+            client.close()
+            raise
+        
+        # The data index only speeds up lookups by user and period; a failure is logged without stopping the app
+        try:
+            data.create_index([('user', 1), ('year', 1), ('month', 1)])
+        except PyMongoError as e:
+            logging.error(f"_init_db();Index creation failed={e}")
+        
+        # References to the client, database and collections, set together once everything is ready
+        self.client = client
+        self.db = db
+        self.users = users
+        self.data = data
+        self.logs = db["logs"]
+        
+        # Build the unique username index (idempotent if it already exists); a failure only blocks registration
+        self.unique_username_index = False
+        self.ensure_unique_username_index()
+
+    def ensure_unique_username_index(self):
+        """
+        Check that the unique index on users.username exists, trying to build it again if an earlier
+        attempt failed. The index is the only guard against duplicate registrations, so registration
+        is refused while it is missing (e.g. until existing duplicate usernames are removed, see README.txt).
         
-        # Select the database
-        self.db = self.client[mongo_database]
+        Returns:
+            True if the index exists, False otherwise.
+        """
+        if self.unique_username_index:
+            return True
+        
+        with self._init_lock:
+            if not self.unique_username_index:
+                try:
+                    self.users.create_index([('username', 1)], unique=True)
+                    self.unique_username_index = True
+                except PyMongoError as e:
+                    logging.critical(f"ensure_unique_username_index();Unique username index creation failed={e}")
+        
+        return self.unique_username_index
+
+    def reconnect(self):
+        """
+        Drop the current MongoDB client so the next database access creates a new one.
+        Called in each gunicorn worker after fork, since a client must not be shared across processes.
+        """
+        with self._init_lock:
+            for name in self._CONNECTION_ATTRIBUTES:
+                self.__dict__.pop(name, None)
+            self._init_failure = None
         
-        # References to collections within the database
-        self.users = self.db["users"]
-        self.data = self.db["data"]
-        self.logs = self.db["logs"]
+        logging.info('reconnect();Database client reset')
 
     # Add a user to the 'users' collection
     def add_user(self, user):
@@ -85,34 +191,44 @@ class Database:
         return result.inserted_id
 
     # Retrieve users from the 'users' collection based on a filter
-    def get_user(self, filter={}):
+    def get_user(self, filter={}, projection=None):
         """
         Retrieve users from the 'users' collection that match the provided filter.
         
         Args:
             filter (dict): The filter criteria to match users (e.g., username).
+            projection (dict): Optional fields to include or exclude from the returned documents.
         
         Returns:
             List of matching user documents.
         """
         logging.info(f"get_user();filter={filter}")
         
-        result = list(self.users.find(filter))
+        # Documents are returned as-is (ObjectId included); the app's orjson provider serializes them
+        result = list(self.users.find(filter, projection))
+        
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"get_user();result={result}")
         
-        logging.info(f"get_user();1.result={result}")
+        return result
+
+    # Update a specific user by its ID
+    def update_user(self, id, data):
+        """
+        Update fields of an existing user in the 'users' collection by its ID.
         
-        returnResult = None
+        Args:
+            id (str | ObjectId): The ID of the user to update.
+            data (dict): The fields to set on the user.
         
-        # Verifica se a lista resultante não está vazia
-        if result:
-            # Serializa os dados dos usuários encontrados
-            returnResult = [self.serialize_data(user) for user in result]
-        else:
-            returnResult = []  # Retorna uma lista vazia se não encontrar usuários
+        Returns:
+            True if a user matched, False otherwise.
+        """
+        result = self.users.update_one({"_id": ObjectId(id)}, {"$set": data})
         
-        logging.info(f"get_user();returnResult={returnResult}")
+        logging.info(f"update_user();id={id};matched_count={result.matched_count}")
         
-        return returnResult
+        return result.matched_count == 1
 
     # Add data to the 'data' collection
     def add_data(self, data):
@@ -125,7 +241,8 @@ class Database:
         Returns:
             The result of the insert operation.
         """
-        logging.info(f"add_data();data={data}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"add_data();data={data}")
         
         result = self.data.insert_one(data)
         
@@ -133,26 +250,51 @@ class Database:
         
         return result.inserted_id
     
+    # Add several records to the 'data' collection in one batch
+    def add_data_many(self, docs):
+        """
+        Insert several new records into the 'data' collection with a single insert_many call.
+        
+        Args:
+            docs (list): The data records to be added.
+        
+        Returns:
+            List of the inserted IDs.
+        """
+        logging.info(f"add_data_many();count={len(docs)}")
+        
+        result = self.data.insert_many(docs, ordered=False)
+        
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"add_data_many();inserted_ids={result.inserted_ids}")
+        
+        return result.inserted_ids
+    
     # Retrieve all data or filter specific records from the 'data' collection
-    def get_all_data(self, filter={}):
+    def get_all_data(self, filter={}, stream=False):
         """
         Retrieve all data from the 'data' collection or use a filter to match specific records.
         
         Args:
             filter (dict): The filter criteria to match data records.
+            stream (bool): If True, return the raw cursor so documents can be consumed one at a time.
         
         Returns:
-            List of matching data documents.
+            List of matching data documents, or a cursor over them when stream is True.
         """
-        result = list(self.data.find(filter))
+        # Fetch documents from MongoDB in large batches to cut round trips on big result sets
+        cursor = self.data.find(filter).batch_size(CURSOR_BATCH_SIZE)
         
-        logging.info(f"get_all_data();result={result}")
+        if stream:
+            return cursor
         
-        all_data_serialized = [self.serialize_data(item) for item in result] if result else []
+        # Documents are returned as-is (ObjectId included); the app's orjson provider serializes them
+        all_data = list(cursor)
         
-        logging.info(f"get_all_data();all_data_serialized={all_data_serialized}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"get_all_data();all_data={all_data}")
         
-        return all_data_serialized
+        return all_data
 
     # Update a specific data record by its ID
     def update_data(self, id, data):
@@ -164,17 +306,16 @@ class Database:
             data (dict): The new data to update the record with.
         
         Returns:
-            The updated data document.
+            The updated data document, or None if no record matched.
         """
         result = self.data.find_one_and_update(
-            {"_id": ObjectId(id)}, {"$set": data}, return_document=True
+            {"_id": ObjectId(id)}, {"$set": data}, return_document=ReturnDocument.AFTER
         )
-
-        all_data_serialized = [self.serialize_data(item) for item in result] if result else []
         
-        logging.info(f"update_data();all_data_serialized={all_data_serialized}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"update_data();result={result}")
         
-        return all_data_serialized
+        return result
 
     # Delete a specific data record by its ID
     def delete_data(self, id):
@@ -182,34 +323,34 @@ class Database:
         Delete a data record from the 'data' collection by its ID.
         
         Args:
-            id (str): The ID of the data record to delete.
+            id (str | ObjectId): The ID of the data record to delete.
         
         Returns:
-            The result of the delete operation.
+            The deleted document, or None if no record matched.
         """
-        result = self.data.delete_one({"_id": ObjectId(id)})
+        result = self.data.find_one_and_delete({"_id": ObjectId(id)})
         
-        logging.info(f"delete_data();result.deleted_count={result}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"delete_data();result={result}")
 
         return result
 
-    def serialize_data(self, data):
+    # Delete several data records by their IDs
+    def delete_many_data(self, ids):
         """
-        Converts MongoDB data into a JSON-serializable format.
+        Delete several data records from the 'data' collection in a single request.
         
         Args:
-            data: The data to serialize, which can be of various types (ObjectId, dict, list).
+            ids (list): The IDs of the data records to delete.
         
         Returns:
-            The JSON-serializable representation of the data.
-        """
-        if isinstance(data, ObjectId):
-            return str(data)  # Convert ObjectId to string
-        if isinstance(data, dict):
-            return {key: self.serialize_data(value) for key, value in data.items()}  # Recursively serialize dictionary
-        if isinstance(data, list):
-            return [self.serialize_data(item) for item in data]  # Recursively serialize list
-        return data  # Return the original data if no conversion is needed
+            The number of deleted records.
+        """
+        result = self.data.delete_many({"_id": {"$in": [ObjectId(id) for id in ids]}})
+        
+        logging.info(f"delete_many_data();deleted_count={result.deleted_count}")
+        
+        return result.deleted_count
     
 # Create a singleton instance of the Database class for use in the application
 database = Database()
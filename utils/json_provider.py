@@ -0,0 +1,63 @@
+import json  # Standard library JSON, used for numbers orjson cannot represent exactly
+import re  # For spotting numbers that may not fit in 64 bits
+import orjson  # Fast JSON encoder/decoder
+from flask.json.provider import DefaultJSONProvider  # Base class for Flask JSON providers
+
+# Digit runs long enough to hold an integer outside the 64-bit range, which orjson reads as a lossy float
+_LONG_NUMBER = re.compile(r'\d{19,}')
+_LONG_NUMBER_BYTES = re.compile(rb'\d{19,}')
+
+def _orjson_dumps(obj):
+    """
+    Serializes an object to JSON bytes with orjson, falling back to the standard library for
+    integers outside the 64-bit range (which orjson refuses), so they are written exactly.
+    """
+    try:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        return json.dumps(obj, default=str, ensure_ascii=False, separators=(',', ':')).encode()
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    A Flask JSON provider backed by orjson, used by both request.get_json() and jsonify.
+    Values orjson cannot serialize natively (e.g. MongoDB ObjectId) are converted with str().
+    Documents with integers beyond 64 bits go through the standard library, which keeps them exact.
+    """
+
+    def dumps(self, obj, **kwargs):
+        """
+        Serializes an object to a JSON string.
+        
+        Args:
+            obj: The object to serialize.
+        
+        Returns:
+            str: The JSON document.
+        """
+        return _orjson_dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        """
+        Deserializes a JSON document.
+        
+        Args:
+            s (str | bytes): The JSON document.
+        
+        Returns:
+            The deserialized object.
+        """
+        pattern = _LONG_NUMBER if isinstance(s, str) else _LONG_NUMBER_BYTES
+        if pattern.search(s):
+            return json.loads(s)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """
+        Builds a JSON response, writing the orjson bytes directly without decoding them to a string.
+        
+        Returns:
+            Response: A response with the application/json mimetype.
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        body = _orjson_dumps(obj)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -1,8 +1,35 @@
 import logging  # Import the logging module to enable logging throughout the application
+import logging.handlers  # Import QueueHandler/QueueListener to write log records off the request thread
+import atexit  # Import atexit to flush queued log records when the process exits
+import queue  # Import queue to pass log records to the background writer thread
 import os  # Import os for working with file paths and directories
 from pathlib import Path  # Import Path to easily manage paths in a platform-independent way
 from datetime import datetime  # Import datetime to generate timestamps for log files
 
+class DailyFileHandler(logging.FileHandler):
+    """
+    A file handler that writes to <directory>/YYYYMMDD_log.log and moves to a new file when the date changes.
+    Unlike TimedRotatingFileHandler it never renames files, so several worker processes can share the log directory.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.current_date = datetime.now().strftime('%Y%m%d')
+        super().__init__(self.file_path(self.current_date), mode='a')  # File mode: 'a' for append
+
+    def file_path(self, date):
+        # Log file name based on the date (format: YYYYMMDD_log.log)
+        return os.path.join(self.directory, date + '_log.log')
+
+    def emit(self, record):
+        record_date = datetime.fromtimestamp(record.created).strftime('%Y%m%d')
+        if record_date != self.current_date:
+            # Close the previous day's file; FileHandler reopens the stream on the new path
+            self.close()
+            self.current_date = record_date
+            self.baseFilename = self.file_path(record_date)
+        super().emit(record)
+
 try:
     # Define the log directory path by joining the current working directory with a 'log' folder
     log_directory = os.path.join(Path.cwd(), 'log')
@@ -10,23 +37,42 @@ try:
     # Ensure the log directory exists. If not, it will be created.
     os.makedirs(log_directory, exist_ok=True)  # 'exist_ok=True' ensures no error if the directory already exists
 
-    # Generate the log file name based on the current date (format: YYYYMMDD_log.log)
-    log_file_name = datetime.now().strftime('%Y%m%d') + '_log.log'
+    # File handler that does the actual (blocking) writes, one file per day; records arrive already formatted
+    file_handler = DailyFileHandler(log_directory)
+
+    # Requests only put records on the queue; a background thread writes them to the file
+    log_queue = queue.Queue(-1)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_listener = logging.handlers.QueueListener(log_queue, file_handler)
+    queue_listener.start()
 
-    # Define the full log file path by joining the log directory with the generated log file name
-    log_file_path = os.path.join(log_directory, log_file_name)
+    def _stop_listener():
+        # Stop the listener of the current process (workers replace it after fork)
+        queue_listener.stop()
+
+    atexit.register(_stop_listener)
+
+    def _restart_listener_after_fork():
+        # The writer thread does not survive fork (e.g. gunicorn workers), so start a new listener with a fresh queue
+        global log_queue, queue_listener
+        log_queue = queue.Queue(-1)
+        queue_handler.queue = log_queue
+        queue_listener = logging.handlers.QueueListener(log_queue, file_handler)
+        queue_listener.start()
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=_restart_listener_after_fork)
 
     # Set up the logging configuration
     logging.basicConfig(
-        filename=log_file_path,  # Log file location
-        filemode='a',  # File mode: 'a' for append, 'w' to overwrite the file on each run
+        handlers=[queue_handler],  # Log records go through the queue to the log file
         format='%(asctime)s - %(levelname)s - %(message)s',  # Log message format: includes timestamp, log level, and the message
         level=logging.INFO  # Log level: INFO (can also be DEBUG, WARNING, ERROR, CRITICAL)
     )
 
     # Log that logging has been set up successfully
     logging.info("Logging setup successfully.")
-    
+
 except Exception as e:
     # Handle any exceptions that occur during the setup process and print an error message
     print(f"Failed to set up logging: {e}")
@@ -3,8 +3,15 @@ import re  # For regular expressions, used for password complexity rules
 import logging  # For logging messages and errors
 import base64  # For encoding data
 import hashlib  # For creating cryptographic hash values
+import hmac  # For signing JWTs with HMAC-SHA256
+import orjson  # For serializing JWT payloads
+import threading  # For guarding the shared token caches
+import time  # For checking token expiry on cached verifications
+from concurrent.futures import ThreadPoolExecutor  # For running bcrypt on a bounded pool of worker threads
+from cachetools import TTLCache  # For caching signed tokens for a limited time
 from bcrypt import checkpw, gensalt, hashpw
-from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes  # For AES encryption/decryption
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes  # For decrypting legacy AES-CBC values
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM  # For AES-GCM authenticated encryption/decryption
 from cryptography.hazmat.backends import default_backend  # For selecting the default cryptographic backend
 import jwt  # For creating and verifying JSON Web Tokens (JWTs)
 from dotenv import load_dotenv  # For loading environment variables from a .env file
@@ -14,20 +21,79 @@ from utils.logging import logging  # Custom logging module
 # Load environment variables from the .env file
 load_dotenv()
 
+# Secret used to sign JWTs, and the 32-byte AES key derived from it, computed once at import
+_SECRET = os.getenv("ENCRYPTION_KEY")
+if not _SECRET:
+    raise RuntimeError("ENCRYPTION_KEY environment variable is not set")
+_SECRET_BYTES = _SECRET.encode()
+_AES_KEY = hashlib.sha256(_SECRET_BYTES).digest()  # SHA-256 digests are already 32 bytes
+
+# AES-GCM cipher shared by encrypt/decrypt (thread-safe and reusable across calls)
+_AEAD = AESGCM(_AES_KEY)
+
+# Nonce length for AES-GCM; values encrypted with the older AES-CBC scheme carry a 16-byte IV
+GCM_NONCE_LENGTH = 12
+CBC_IV_LENGTH = 16
+
+# Signed tokens are reused for the same user for TOKEN_CACHE_TTL seconds instead of re-signing on every login
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", "300"))
+_token_cache = TTLCache(maxsize=10000, ttl=TOKEN_CACHE_TTL)
+_token_cache_lock = threading.Lock()
+
+# Verified token payloads are reused for TOKEN_VERIFY_CACHE_TTL seconds instead of re-checking the signature
+TOKEN_VERIFY_CACHE_TTL = int(os.getenv("TOKEN_VERIFY_CACHE_TTL", "30"))
+_verified_token_cache = TTLCache(maxsize=2048, ttl=TOKEN_VERIFY_CACHE_TTL)
+_verified_token_cache_lock = threading.Lock()
+
+def _b64url(data):
+    """
+    Encodes bytes as unpadded URL-safe base64, as used in JWT segments.
+    """
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+# The HS256 JWT header never changes, so its encoded segment is built once
+JWT_HEADER_B64 = _b64url(b'{"alg":"HS256","typ":"JWT"}')
+
+# bcrypt releases the GIL, so hashing runs on a pool sized to the CPU count to keep it parallel but bounded
+BCRYPT_POOL = ThreadPoolExecutor(max_workers=os.cpu_count())
+
+# bcrypt work factor, tunable per deployment (each step doubles the hashing time)
+BCRYPT_COST = int(os.getenv("BCRYPT_COST", "10"))
+if not 4 <= BCRYPT_COST <= 31:
+    raise ValueError(f"BCRYPT_COST must be between 4 and 31, got {BCRYPT_COST}")
+
+# Password complexity rules: at least 8 characters with a lowercase letter, an uppercase letter and a digit
+PASSWORD_RULES = re.compile(r"^(?=.*[a-z])(?=.*[A-Z])(?=.*\d).{8,}$")
+
+# bcrypt only uses the first 72 bytes of its input
+BCRYPT_MAX_PASSWORD_BYTES = 72
+
+def _prehash_password(password):
+    """
+    Reduces a password to a fixed-length bcrypt input: base64(sha256(password)).
+    The 44-byte result stays under BCRYPT_MAX_PASSWORD_BYTES, so long passwords are never truncated.
+    """
+    return base64.b64encode(hashlib.sha256(password.encode('utf-8')).digest())
+
+# Highest bcrypt cost among stored hashes: hashes from before BCRYPT_COST used gensalt()'s default of 12,
+# and stronger hashes are never rehashed to a lower cost
+BCRYPT_MAX_STORED_COST = int(os.getenv("BCRYPT_MAX_STORED_COST", str(max(BCRYPT_COST, 12))))
+
+# Hash checked against when a user does not exist, built at the highest stored cost so unknown usernames
+# never cost less bcrypt work than an existing account
+DUMMY_HASH = hashpw(_prehash_password("x"), gensalt(rounds=BCRYPT_MAX_STORED_COST))
+
 class Utils:
     """
     A utility class that handles various tasks such as encryption, token creation, 
     and password validation.
     """
 
-    def __init__(self):
-        """
-        Initializes the Utils class by loading encryption settings and password complexity rules.
-        - ENCRYPTION_KEY: 32-byte encryption key derived from an environment variable.
-        - IV_LENGTH: Length of the initialization vector (IV) for AES encryption.
-        """
-        self.ENCRYPTION_KEY = hashlib.sha256(os.getenv("ENCRYPTION_KEY").encode()).digest()[:32]  # Generate a 32-byte encryption key
-        self.IV_LENGTH = 16  # AES uses a 16-byte IV
+    # Encryption settings, computed once at import:
+    # - ENCRYPTION_KEY: 32-byte encryption key derived from an environment variable.
+    # - IV_LENGTH: Length of the nonce used for AES-GCM encryption.
+    ENCRYPTION_KEY = _AES_KEY
+    IV_LENGTH = GCM_NONCE_LENGTH
 
     def create_token(self, user):
         """
@@ -39,12 +105,28 @@ class Utils:
         Returns:
             str: The signed JWT token.
         """
+        # Return the token already minted for this user while it is still cached
+        cache_key = hashlib.blake2b(
+            f"{user[0]['username']}|{user[0]['_id']}|{user[0].get('role')}".encode(), digest_size=16
+        ).digest()
+        with _token_cache_lock:
+            token = _token_cache.get(cache_key)
+        if token:
+            return token
+
         payload = {
             'id': user[0]['_id'],  # MongoDB user ID
             'username': user[0]['username']  # Username
         }
-        secret_key = os.getenv("ENCRYPTION_KEY")  # Retrieve the secret key from environment variables
-        token = jwt.encode(payload, secret_key, algorithm="HS256")  # Sign the JWT using HMAC and SHA-256
+        # Sign the JWT using HMAC and SHA-256: header.payload.signature
+        # (same bytes as jwt.encode for ASCII payloads; orjson writes other characters as raw UTF-8
+        # instead of \uXXXX escapes, which decodes to the same payload)
+        signing_input = JWT_HEADER_B64 + b'.' + _b64url(orjson.dumps(payload, default=str))
+        signature = hmac.new(_SECRET_BYTES, signing_input, hashlib.sha256).digest()
+        token = (signing_input + b'.' + _b64url(signature)).decode()
+
+        with _token_cache_lock:
+            _token_cache[cache_key] = token
         return token
 
     def verify_token(self, token):
@@ -61,10 +143,17 @@ class Utils:
             logging.error("verify_token();Token required")  # Log if no token is provided
             return None
 
+        # Reuse the payload of a recently verified token, unless its 'exp' claim has passed since
+        with _verified_token_cache_lock:
+            userToken = _verified_token_cache.get(token)
+        if userToken is not None and userToken.get('exp', float('inf')) > time.time():
+            return dict(userToken)
+
         try:
-            secret_key = os.getenv("ENCRYPTION_KEY")  # Retrieve the secret key from environment variables
-            userToken = jwt.decode(token, secret_key, algorithms=['HS256'])  # Decode and verify the token
-            return userToken
+            userToken = jwt.decode(token, _SECRET, algorithms=['HS256'])  # Decode and verify the token
+            with _verified_token_cache_lock:
+                _verified_token_cache[token] = userToken
+            return dict(userToken)
         except jwt.ExpiredSignatureError as e:
             logging.error(f"verify_token();Token has expired={e}")  # Log if the token has expired
             return None
@@ -74,30 +163,24 @@ class Utils:
 
     def encrypt(self, text):
         """
-        Encrypts the provided text using AES encryption in CBC mode.
+        Encrypts the provided text using AES encryption in GCM mode.
         
         Args:
             text (str): The text to be encrypted.
         
         Returns:
-            str: The encrypted text, represented as a hexadecimal string with IV.
+            str: The encrypted text (with authentication tag), represented as a hexadecimal string with nonce.
         """
-        iv = os.urandom(self.IV_LENGTH)  # Generate a random IV
-        cipher = Cipher(algorithms.AES(self.ENCRYPTION_KEY), modes.CBC(iv), backend=default_backend())  # AES-CBC cipher
-        encryptor = cipher.encryptor()
-
-        # Pad the text to be a multiple of the block size (16 bytes for AES)
-        padded_text = text + (algorithms.AES.block_size - len(text) % algorithms.AES.block_size) * chr(algorithms.AES.block_size - len(text) % algorithms.AES.block_size)
+        iv = os.urandom(GCM_NONCE_LENGTH)  # Generate a random nonce
+        encrypted = _AEAD.encrypt(iv, text.encode('utf-8'), None)
         
-        # Perform the encryption
-        encrypted = encryptor.update(padded_text.encode('utf-8')) + encryptor.finalize()
-        
-        # Return the IV and encrypted text, both as hex strings
+        # Return the nonce and encrypted text, both as hex strings
         return iv.hex() + ":" + encrypted.hex()
 
     def decrypt(self, text):
         """
-        Decrypts the provided encrypted text using AES decryption in CBC mode.
+        Decrypts the provided encrypted text using AES decryption in GCM mode.
+        Values produced by the older AES-CBC scheme (16-byte IV) are still accepted.
         
         Args:
             text (str): The encrypted text, formatted as a hexadecimal string with IV.
@@ -112,34 +195,78 @@ class Utils:
         text_parts = text.split(":")
         iv = bytes.fromhex(text_parts[0])  # Convert the IV from hex to bytes
         encrypted_text = bytes.fromhex(text_parts[1])  # Convert the encrypted text from hex to bytes
+
+        if len(iv) != CBC_IV_LENGTH:
+            # Decrypt and verify the authentication tag
+            return _AEAD.decrypt(iv, encrypted_text, None).decode('utf-8')
         
-        # Set up the AES-CBC cipher for decryption
-        cipher = Cipher(algorithms.AES(self.ENCRYPTION_KEY), modes.CBC(iv), backend=default_backend())
+        # Legacy AES-CBC value
+        cipher = Cipher(algorithms.AES(_AES_KEY), modes.CBC(iv), backend=default_backend())
         decryptor = cipher.decryptor()
-        
-        # Perform the decryption
         decrypted = decryptor.update(encrypted_text) + decryptor.finalize()
         
         # Remove padding
         padding_length = decrypted[-1]
         return decrypted[:-padding_length].decode('utf-8')
 
+    def validate_password_rules(self, password):
+        """
+        Checks that a password meets the complexity rules (see PASSWORD_RULES).
+        
+        Args:
+            password (str): The plaintext password.
+        
+        Returns:
+            bool: True if the password is complex enough, False otherwise.
+        """
+        return PASSWORD_RULES.match(password) is not None
+
     def hash_password(self, password):
-        return hashpw(password.encode(), gensalt()).decode()
+        """
+        Hashes a password with bcrypt after SHA-256 pre-hashing it.
+        
+        Args:
+            password (str): The plaintext password.
+        
+        Returns:
+            str: The bcrypt hash.
+        """
+        return BCRYPT_POOL.submit(hashpw, _prehash_password(password), gensalt(rounds=BCRYPT_COST)).result().decode()
 
-    def validate_password(self, stored_hash, entered_password):
-        return checkpw(entered_password.encode(), stored_hash.encode())
+    def needs_rehash(self, stored_hash, prehashed=True):
+        """
+        Checks whether a stored hash should be replaced by one from hash_password: legacy hashes and
+        hashes made at a lower cost than BCRYPT_COST. Stronger hashes are kept as they are.
+        
+        Args:
+            stored_hash (str): The stored bcrypt hash ($2b$<cost>$...).
+            prehashed (bool): False for legacy hashes created from the raw password bytes.
+        
+        Returns:
+            bool: True if the password should be rehashed, False otherwise.
+        """
+        return not prehashed or int(stored_hash.split('$')[2]) < BCRYPT_COST
 
-    def validatePassword(self, encryptPassword, sendPassword):
+    def validate_password(self, stored_hash, entered_password, prehashed=True):
         """
-        Validates the provided password by comparing it with its encrypted version.
+        Checks a plaintext password against a stored bcrypt hash.
         
         Args:
-            encryptPassword (str): The encrypted password.
-            sendPassword (str): The plaintext password to validate.
+            stored_hash (str): The stored bcrypt hash, or None when the user does not exist.
+            entered_password (str): The plaintext password to check.
+            prehashed (bool): False for legacy hashes created from the raw password bytes.
         
         Returns:
-            bool: True if the passwords match, False otherwise.
+            bool: True if the password matches, False otherwise.
         """
-        decryptPass = self.decrypt(encryptPassword)  # Decrypt the encrypted password
-        return decryptPass == sendPassword  # Compare decrypted password with the provided plaintext password
+        if not stored_hash:
+            # No user: burn the same bcrypt work on the dummy hash and always fail
+            BCRYPT_POOL.submit(checkpw, _prehash_password(entered_password), DUMMY_HASH).result()
+            return False
+
+        if prehashed:
+            password_bytes = _prehash_password(entered_password)
+        else:
+            # Legacy hashes only ever covered the first 72 bytes of the password; bcrypt ignores the rest
+            password_bytes = entered_password.encode()[:BCRYPT_MAX_PASSWORD_BYTES]
+        return BCRYPT_POOL.submit(checkpw, password_bytes, stored_hash.encode()).result()